@@ -2,10 +2,51 @@
 import os
 import json
 import six
+import threading
 
 from abc import ABCMeta, abstractproperty, abstractmethod
 from .util import read_file
 from .model import ApiData
+from .cache import file_stamp
+
+
+class ApiDataSnapshots(object):
+    """Loaded ApiData shared between requests.
+
+    Data file is loaded again only when its mtime, size or inode changes
+    or when the snapshot is invalidated (ApiDataModel.save does it).
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename, model_class=None):
+        if model_class is None:
+            model_class = ApiDataModel
+
+        stamp = file_stamp(filename)
+        snapshot = self._snapshots.get(filename)
+
+        if snapshot is not None and snapshot[0] == stamp:
+            return snapshot[1]
+
+        api_data = ApiData(model_class(filename))
+        api_data.load()
+
+        with self._lock:
+            self._snapshots[filename] = (stamp, api_data)
+
+        return api_data
+
+    def invalidate(self, filename=None):
+        with self._lock:
+            if filename is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(filename, None)
+
+snapshots = ApiDataSnapshots()
 
 
 class ApiSettingsBase(six.with_metaclass(ABCMeta, object)):
@@ -22,6 +63,12 @@ class ApiSettingsBase(six.with_metaclass(ABCMeta, object)):
     def api_data(self):
         pass
 
+    def get_shared_api_data(self, filename, model_class=None):
+        """Returns ApiData loaded from ``filename`` shared by all requests,
+        subclasses can use it in ``api_data``.
+        """
+        return snapshots.get(filename, model_class)
+
 
 class ApiDataModelBase(six.with_metaclass(ABCMeta, object)):
 
@@ -36,11 +83,15 @@ class ApiDataModelBase(six.with_metaclass(ABCMeta, object)):
 
 class ApiSettings(ApiSettingsBase):
 
+    _created_dirs = set()
+
     def __init__(self, settings, request):
         super(ApiSettings, self).__init__(settings, request)
 
-        if not os.path.exists(self.api_dir):
-            os.makedirs(self.api_dir)
+        if self.api_dir not in self._created_dirs:
+            if not os.path.exists(self.api_dir):
+                os.makedirs(self.api_dir)
+            self._created_dirs.add(self.api_dir)
 
     @property
     def api_dir(self):
@@ -48,12 +99,8 @@ class ApiSettings(ApiSettingsBase):
 
     @property
     def api_data(self):
-        api_data = ApiData(
-            ApiDataModel(os.path.join(
-                self.api_dir, self._settings["api_data_filename"])))
-        api_data.load()
-
-        return api_data
+        return self.get_shared_api_data(os.path.join(
+            self.api_dir, self._settings["api_data_filename"]))
 
 
 class ApiDataModel(ApiDataModelBase):
@@ -75,3 +122,5 @@ class ApiDataModel(ApiDataModelBase):
     def save(self, data):
         with open(self.filename, "w") as f:
             f.write(json.dumps(data))
+
+        snapshots.invalidate(self.filename)
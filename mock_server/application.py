@@ -4,6 +4,11 @@ import os
 import tornado.web
 from . import handlers
 from . import api_settings
+from . import routes
+from . import cache
+from . import writers
+from . import rest
+from . import upstream
 import imp
 
 from concurrent import futures
@@ -12,11 +17,36 @@ from .data import SUPPORTED_FORMATS
 
 class Application(tornado.web.Application):
     def __init__(self, port, address, api_dir, debug,
-                 api_data_filename, custom_provider=None):
+                 api_data_filename, custom_provider=None, **kwargs):
 
         self.pool = futures.ThreadPoolExecutor(2)
         self.api_settings_class = api_settings.ApiSettings
         self.custom_provider = None
+        self.route_indexes = {}
+        self.content_cache = cache.ContentCache(
+            kwargs.get("content_cache_size", cache.DEFAULT_MAX_SIZE),
+            kwargs.get("cache_check_interval", cache.DEFAULT_CHECK_INTERVAL))
+        self.encoder = rest.ResponseEncoder(
+            kwargs.get("compress_min_length", rest.DEFAULT_COMPRESS_MIN_LENGTH)
+            if kwargs.get("precompress", True) else None,
+            kwargs.get("compress_level", 6),
+            kwargs.get("minify_json", False),
+            kwargs.get("stream_threshold", 8 * 1024 * 1024))
+        self.access_log = writers.AccessLogWriter(
+            max_queue_size=kwargs.get("log_queue_size", 10000),
+            flush_interval=kwargs.get("log_flush_interval", 1.0),
+            flush_size=kwargs.get("log_flush_size", 100),
+            overflow=kwargs.get("log_overflow", writers.DROP))
+        self.upstream_client = upstream.UpstreamClient(
+            max_clients=kwargs.get(
+                "upstream_max_clients", upstream.DEFAULT_MAX_CLIENTS),
+            max_per_host=kwargs.get(
+                "upstream_max_per_host", upstream.DEFAULT_MAX_PER_HOST),
+            connect_timeout=kwargs.get(
+                "upstream_connect_timeout", upstream.DEFAULT_CONNECT_TIMEOUT),
+            request_timeout=kwargs.get(
+                "upstream_request_timeout", upstream.DEFAULT_REQUEST_TIMEOUT),
+            use_curl=kwargs.get("upstream_curl", False))
 
         if custom_provider is not None:
             provider_path = os.path.abspath(custom_provider)
@@ -37,6 +67,8 @@ class Application(tornado.web.Application):
             (r"/__manage/logout", handlers.LogoutHandler),
             (r"/__manage/settings", handlers.SettingsHandler),
             (r"/__manage/todo", handlers.TodoHandler),
+            (r"/__manage/stats", handlers.StatsHandler),
+            (r"/__manage/cache", handlers.CacheHandler),
             (r"/__manage", handlers.ListResourcesHandler),
             (r"/%s" % handlers.RPCHandler.PATH, handlers.RPCHandler),
             (r"/(.*)(%s)" % supported_formats, handlers.MainHandler),
@@ -54,4 +86,22 @@ class Application(tornado.web.Application):
             login_url="/__manage/login",
             cookie_secret="__TODO:_GENERATE_YOUR_OWN_RANDOM_VALUE_HERE__",
         )
+        settings.update(kwargs)
         super(Application, self).__init__(handlers_list, **settings)
+
+    def get_route_index(self, api_dir):
+        if api_dir not in self.route_indexes:
+            self.route_indexes[api_dir] = routes.RouteIndex(api_dir)
+
+        return self.route_indexes[api_dir]
+
+    def stats(self):
+        return {
+            "content_cache": self.content_cache.stats(),
+            "access_log": self.access_log.stats(),
+            "upstream": self.upstream_client.stats()
+        }
+
+    def close(self):
+        self.access_log.close()
+        self.upstream_client.close()
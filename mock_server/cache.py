@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from .ordereddict import OrderedDict
+
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+DEFAULT_CHECK_INTERVAL = 1.0
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+class _Entry(object):
+
+    __slots__ = ("value", "size", "stamp", "checked")
+
+    def __init__(self, value, size, stamp, checked):
+        self.value = value
+        self.size = size
+        self.stamp = stamp
+        self.checked = checked
+
+
+class _Load(object):
+
+    __slots__ = ("event", "value")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class ContentCache(object):
+    """Process-wide LRU cache of values loaded from files.
+
+    Every value is stamped with mtime, size and inode of the files it was
+    loaded from and reloaded when the stamp changes. Files are checked at
+    most once per ``check_interval`` seconds, ``None`` disables checking
+    (somebody else has to call :meth:`invalidate`). Concurrent misses of
+    the same key are coalesced into one load.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get(self, key, paths, load):
+        """Returns value for ``key`` loaded from ``paths``.
+
+        ``load`` is called on miss and has to return tuple
+        ``(value, size)``. When the first of ``paths`` doesn't exist
+        ``None`` is returned.
+        """
+        entry = self._entries.get(key)
+
+        if entry is not None and self._is_fresh(entry, paths):
+            with self._lock:
+                if key in self._entries:
+                    self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+            return entry.value
+
+        with self._lock:
+            pending = self._loading.get(key)
+            if pending is None:
+                pending = self._loading[key] = _Load()
+                owner = True
+            else:
+                owner = False
+                self.coalesced += 1
+
+        if not owner:
+            pending.event.wait()
+            return pending.value
+
+        try:
+            pending.value = self._load(key, paths, load)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            pending.event.set()
+
+        return pending.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def flush(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "size": self._size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced
+        }
+
+    def _is_fresh(self, entry, paths):
+        if self.check_interval is None:
+            return True
+
+        now = time.time()
+
+        if now - entry.checked < self.check_interval:
+            return True
+
+        if tuple(file_stamp(path) for path in paths) != entry.stamp:
+            return False
+
+        entry.checked = now
+        return True
+
+    def _load(self, key, paths, load):
+        with self._lock:
+            self.misses += 1
+
+        checked = time.time()
+        stamp = tuple(file_stamp(path) for path in paths)
+
+        if stamp[0] is None:
+            self.invalidate(key)
+            return None
+
+        value, size = load()
+
+        with self._lock:
+            self._remove(key)
+
+            if value is not None and size <= self.max_size:
+                self._entries[key] = _Entry(value, size, stamp, checked)
+                self._size += size
+                self._evict()
+
+        return value
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._size -= entry.size
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            self.evictions += 1
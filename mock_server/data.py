@@ -33,3 +33,12 @@ SUPPORTED_MIMES = _supported_mimes(SUPPORTED_FORMATS)
 
 SUPPORTED_METHODS = ("GET", "HEAD", "POST", "DELETE", "PATCH",
                      "PUT", "OPTIONS")
+
+# response validators of mock files
+ETAG = "etag"
+LAST_MODIFIED = "last-modified"
+ALL_VALIDATORS = "all"
+NO_VALIDATORS = "none"
+
+DEFAULT_VALIDATOR = ALL_VALIDATORS
+SUPPORTED_VALIDATORS = (ETAG, LAST_MODIFIED, ALL_VALIDATORS, NO_VALIDATORS)
@@ -2,14 +2,21 @@
 
 import os
 import re
+import mmap
 import bcrypt
 import datetime
+import email.utils
 import tornado.web
 
 from crypt import crypt
 from tornado import gen
+from tornado import httputil
+from tornado import queues
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 from .data import SUPPORTED_FORMATS, SUPPORTED_MIMES, DEFAULT_FORMAT
 from .data import SUPPORTED_METHODS
+from .data import DEFAULT_VALIDATOR, ETAG, LAST_MODIFIED, ALL_VALIDATORS
 from .tornado_flash_message_mixin import FlashMessageMixin
 from .tornado_http_auth_basic_mixin import HttpAuthBasicMixin
 from .model import ResourceMethod, RPCMethod, gencryptsalt
@@ -34,6 +41,10 @@ except ImportError:
     fastrpc_available = False
 
 
+STREAM_CHUNK_SIZE = 64 * 1024
+PROXY_BODY_QUEUE_SIZE = 16
+
+
 class BaseHandler(tornado.web.RequestHandler):
 
     def get_current_user(self):
@@ -63,7 +74,7 @@ class BaseHandler(tornado.web.RequestHandler):
             "status": self.get_status(),
             "remote_ip": self.request.remote_ip,
             "request_time": 1000.0 * self.request.request_time(),
-            "headers": self.request.headers,
+            "headers": dict(self.request.headers),
             "body": str(self.request.body),
             "time": datetime.datetime.now().isoformat()
         }
@@ -71,7 +82,7 @@ class BaseHandler(tornado.web.RequestHandler):
         if response is not None:
             data["response"] = response
 
-        model.add_to_resources_log(self.log_request_name, data)
+        self.application.access_log.write((self.log_request_name, data))
 
     @property
     def log_request_name(self):
@@ -86,8 +97,11 @@ class BaseHandler(tornado.web.RequestHandler):
         self.finish()
 
 
+@tornado.web.stream_request_body
 class MainHandler(BaseHandler, HttpAuthBasicMixin):
 
+    validator = DEFAULT_VALIDATOR
+
     def check_auth(self, http_username, http_password):
         username = self.api_data.http_username
         password = self.api_data.http_password
@@ -107,9 +121,40 @@ class MainHandler(BaseHandler, HttpAuthBasicMixin):
     def prepare(self):
         super(MainHandler, self).prepare()
 
+        self._chunks = []
+        self._body_queue = None
+        self._proxied = False
+
         if self.api_data.http_username:
             self.authorize()
 
+        if not self._finished and self._is_body_streamed(*self.path_args):
+            # forward body to upstream while it is being received
+            self._body_queue = queues.Queue(PROXY_BODY_QUEUE_SIZE)
+            self._read_request_arguments(
+                (self.path_args + [DEFAULT_FORMAT])[1])
+            self._handle_request_on_upstream()
+
+    def data_received(self, chunk):
+        if self._body_queue is not None:
+            return self._body_queue.put(chunk)
+
+        if not self._proxied:
+            self._chunks.append(chunk)
+
+    def on_connection_close(self):
+        # body Future is replaced by the body in _resolve_request
+        if not isinstance(self.request.body, bytes):
+            super(MainHandler, self).on_connection_close()
+
+    def _is_body_streamed(self, url_path, format=DEFAULT_FORMAT):
+        return (self.settings.get("upstream_streaming", False) and
+                self.request.method in ("POST", "PATCH", "PUT") and
+                self.application.custom_provider is None and
+                bool(self.api_data.upstream_server) and
+                self.api_data.get_upstream_server(
+                    "%s-%s" % (self.request.method, url_path)))
+
     @tornado.web.asynchronous
     def head(self, path, format=DEFAULT_FORMAT):
         self._resolve_request(path, format)
@@ -157,19 +202,98 @@ class MainHandler(BaseHandler, HttpAuthBasicMixin):
         self.finish()
 
     def _handle_request_on_upstream(self):
-        provider = rest.UpstreamServerProvider(
-            self.api_data.upstream_server)
+        self._proxied = True
 
-        provider({
+        data = {
             "uri": self.request.uri,
             "method": self.request.method,
             "body": self.request.body,
             "headers": self.request.headers,
             "status_code": self.status_code,
             "format": self.format
-        }, self._write_response)
+        }
+
+        if not self.settings.get("upstream_streaming", False):
+            provider = rest.UpstreamServerProvider(
+                self.api_data.upstream_server,
+                self.application.upstream_client,
+                self.api_data.upstream_options)
+            return provider(data, self._write_response)
+
+        provider = rest.StreamingUpstreamServerProvider(
+            self.api_data.upstream_server, self._on_upstream_headers,
+            self._on_upstream_chunk, self.application.upstream_client,
+            self.api_data.upstream_options)
+
+        if self._body_queue is not None:
+            data["body"] = None
+            data["body_producer"] = self._produce_body
+
+        provider(data, lambda response:
+                 self._on_upstream_response(provider, response))
+
+    @gen.coroutine
+    def _produce_body(self, write):
+        queue = self._body_queue
+
+        while True:
+            chunk = yield queue.get()
+            if chunk is None:
+                return
+            yield write(chunk)
+
+    def _on_upstream_headers(self, status_code, reason, headers):
+        self.set_status(status_code, reason)
+
+        for name, value in headers:
+            self.clear_header(name)
+        for name, value in headers:
+            self.add_header(name, value)
+
+        self.flush()
+
+    def _on_upstream_chunk(self, chunk):
+        self.write(chunk)
+
+        # upstream is not read until the chunk is sent to the client
+        return self.flush()
+
+    def _on_upstream_response(self, provider, response):
+        queue, self._body_queue = self._body_queue, None
+
+        # release data_received waiting for the full queue
+        while queue is not None and queue.qsize():
+            queue.get_nowait()
+
+        if not provider.headers_received:
+            return self._write_response(response)
+
+        if response.status_code == 599:
+            # the body is incomplete, client has to see the failure
+            self.request.connection.stream.close()
+            return
+
+        self.finish()
+
+    def _read_request_arguments(self, format):
+        self.format = self._get_format(format)
+        self.status_code = int(self.get_argument("__statusCode", 200))
 
     def _resolve_request(self, url_path, format):
+        if self._proxied:
+            if self._body_queue is not None:
+                # whole body was received
+                self._body_queue.put(None)
+            return
+
+        self.request.body = b"".join(self._chunks)
+        httputil.parse_body_arguments(
+            self.request.headers.get("Content-Type", ""), self.request.body,
+            self.request.body_arguments, self.request.files,
+            self.request.headers)
+        for name, values in self.request.body_arguments.items():
+            self.request.arguments.setdefault(name, []).extend(values)
+
         # custom provider
         if self.application.custom_provider is not None:
             response = self.application.custom_provider(self.request)
@@ -177,9 +301,8 @@ class MainHandler(BaseHandler, HttpAuthBasicMixin):
                 return self._write_response(response)
 
         # get request data
-        self.format = self._get_format(format)
+        self._read_request_arguments(format)
         method = self.request.method
-        self.status_code = int(self.get_argument("__statusCode", 200))
 
         # upstream server
         upstream_server = self.api_data.get_upstream_server(
@@ -189,7 +312,9 @@ class MainHandler(BaseHandler, HttpAuthBasicMixin):
             return self._handle_request_on_upstream()
 
         # mock
-        provider = rest.FilesMockProvider(self.api_dir)
+        provider = rest.FilesMockProvider(
+            self.api_dir, self.application.get_route_index(self.api_dir),
+            self.application.content_cache, self.application.encoder)
 
         response = rest.resolve_request(
             provider, method, url_path, self.status_code, self.format)
@@ -198,31 +323,153 @@ class MainHandler(BaseHandler, HttpAuthBasicMixin):
             if self.api_data.upstream_server:
                 return self._handle_request_on_upstream()
 
-        # set content type
-        already_content_type = [
-            item[0] for item in response.headers
-            if item[0] == 'Content-Type']
-        if not already_content_type:
-            content_type = SUPPORTED_FORMATS[self.format][0]
-            response.headers.append(
-                ("Content-Type", "%s; charset=utf-8" % content_type))
-        response.headers.append(
-            ("Access-Control-Allow-Origin", "*"))
+        response = rest.prepare_response(response, self.format)
+
+        if response.last_modified is not None:
+            self.validator = self.api_data.get_validator(
+                "%s-%s" % (method, url_path))
 
         # log request
         self.log_request(response)
 
-        # response
+        self._write_prepared_response(response)
+
+    def _write_prepared_response(self, response):
+        # ranges are served from identity
+        if "Range" not in self.request.headers:
+            response = response.get_variant(
+                self.request.headers.get("Accept-Encoding"))
+
         try:
             self.set_status(response.status_code)
         except ValueError:
             self._reason = 'Custom status code'
 
-        self.set_headers(response.headers)
+        for name, value in response.headers:
+            self._headers[name] = value
+
+        if response.last_modified is not None:
+            if self.validator in (ETAG, ALL_VALIDATORS):
+                self._headers["Etag"] = response.etag
+            if self.validator in (LAST_MODIFIED, ALL_VALIDATORS):
+                self._headers["Last-Modified"] = \
+                    response.last_modified_header
+
+            if response.status_code == 200 and \
+                    self.request.method in ("GET", "HEAD") and \
+                    self._is_not_modified(response):
+                self.set_status(304)
+                return self.finish()
+
+        # range
+        start, end = None, None
+
+        if response.last_modified is not None and \
+                response.status_code == 200 and \
+                self.request.method in ("GET", "HEAD") and \
+                "Range" in self.request.headers and \
+                self._is_range_valid(response):
+            request_range = httputil._parse_request_range(
+                self.request.headers["Range"])
+
+            if request_range is not None:
+                start, end = request_range
+                size = response.content_length
+
+                if (start is not None and start >= size) or end == 0:
+                    self.clear()
+                    self.set_status(416)
+                    self.set_header("Content-Type", "text/plain")
+                    self.set_header("Content-Range", "bytes */%s" % size)
+                    return self.finish()
+
+                if start is not None and start < 0:
+                    start = max(start + size, 0)
+                if end is not None and end > size:
+                    end = size
+
+                if (end or size) - (start or 0) != size:
+                    self.set_status(206)
+                    self._headers["Content-Range"] = \
+                        httputil._get_content_range(start, end, size)
+                    self._headers["Content-Length"] = \
+                        str((end or size) - (start or 0))
+                else:
+                    start, end = None, None
+
+        if self.request.method == "HEAD":
+            return self.finish()
+
+        if isinstance(response, rest.StreamedResponse):
+            return IOLoop.current().add_future(
+                self._write_stream(response, start or 0,
+                                   end or response.content_length),
+                lambda future: future.result())
+
+        if start is None and end is None:
+            self.write(response.content)
+        else:
+            self.write(response.content[start:end])
+
+        self.finish()
+
+    @gen.coroutine
+    def _write_stream(self, response, start, end):
+        with open(response.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                while start < end:
+                    # file was truncated, stop before reading past its end
+                    if os.fstat(f.fileno()).st_size < end:
+                        self.request.connection.stream.close()
+                        return
+
+                    chunk_end = min(start + STREAM_CHUNK_SIZE, end)
+                    self.write(data[start:chunk_end])
+                    start = chunk_end
+
+                    yield self.flush()
+            except StreamClosedError:
+                return
+            finally:
+                data.close()
 
-        self.write(response.content)
         self.finish()
 
+    def _is_range_valid(self, response):
+        if_range = self.request.headers.get("If-Range")
+
+        if not if_range:
+            return True
+
+        if if_range.startswith(("\"", "W/")):
+            return if_range == response.etag
+
+        return if_range == response.last_modified_header
+
+    def _is_not_modified(self, response):
+        if "If-None-Match" in self.request.headers:
+            return (self.validator in (ETAG, ALL_VALIDATORS) and
+                    self.check_etag_header())
+
+        if_modified_since = self.request.headers.get("If-Modified-Since")
+
+        if if_modified_since and \
+                self.validator in (LAST_MODIFIED, ALL_VALIDATORS):
+            date_tuple = email.utils.parsedate(if_modified_since)
+            if date_tuple is not None:
+                return (datetime.datetime(*date_tuple[:6]) >=
+                        response.last_modified)
+
+        return False
+
+    def compute_etag(self):
+        if self.validator not in (ETAG, ALL_VALIDATORS):
+            return None
+
+        return super(MainHandler, self).compute_etag()
+
     def _default_response(self, url_path, method, status_code, format):
         self.set_status(404)
         self.render("api_not_exists.html", url_path=url_path, method=method,
@@ -305,13 +552,16 @@ class RPCHandler(BaseHandler):
             self.rpclib = xmlrpc
 
     def _handle_request_on_upstream(self, request_data):
-        provider = self.rpclib.UpstreamServerProvider(
-            self.api_data.upstream_server)
-
-        if fastrpc_available and \
-                isinstance(provider, fastrpcapi.UpstreamServerProvider):
+        if fastrpc_available and self.rpclib is fastrpcapi:
+            provider = self.rpclib.UpstreamServerProvider(
+                self.api_data.upstream_server)
             provider(request_data, self._write_response)
         else:
+            provider = self.rpclib.UpstreamServerProvider(
+                self.api_data.upstream_server,
+                self.application.upstream_client,
+                self.api_data.upstream_options)
+
             headers = self.request.headers
             headers["Accept"] = self.content_type
 
@@ -355,6 +605,7 @@ class RPCHandler(BaseHandler):
 
 class ResourcesLogsHandler(BaseHandler):
     def get(self):
+        self.application.access_log.flush()
         self.render("resources_logs.html",
                     data=model.load_resources_log(self.log_request_name))
 
@@ -454,6 +705,9 @@ class CreateResourceMethodHandler(BaseHandler, FlashMessageMixin):
             self.api_data.save_category(
                 method_file.id, data["category"])
 
+        self.application.get_route_index(self.api_dir).invalidate()
+        self.application.content_cache.flush()
+
         self.set_flash_message(
             "success",
             "Resource '%s' has been successfully created." % data["url_path"])
@@ -547,6 +801,8 @@ class ResourceMethodHandler(BaseHandler, FlashMessageMixin):
         method_file.delete()
 
         self.api_data.delete_resource(resource)
+        self.application.get_route_index(self.api_dir).invalidate()
+        self.application.content_cache.flush()
 
         # redirect
         self.set_flash_message(
@@ -707,3 +963,24 @@ class TodoHandler(BaseHandler):
 
         self.set_header("Content-Type", "application/json")
         self.write("OK")
+
+
+class StatsHandler(BaseHandler):
+
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write(tornado.escape.json_encode(self.application.stats()))
+
+
+class CacheHandler(BaseHandler):
+
+    @tornado.web.authenticated
+    def post(self):
+        # check xsrf cookie
+        self.check_xsrf_cookie()
+
+        self.application.content_cache.flush()
+
+        self.set_header("Content-Type", "application/json")
+        self.write(tornado.escape.json_encode(
+            self.application.content_cache.stats()))
@@ -14,7 +14,11 @@ from string import ascii_letters, digits
 from random import choice
 from tornado.escape import utf8
 from .util import read_file, ExtendedJSONEncoder
-from .data import SUPPORTED_METHODS
+from .data import SUPPORTED_METHODS, DEFAULT_VALIDATOR
+from .routes import SegmentTrie, split_path
+
+
+RESOURCE_RE = re.compile(r"(%s)-(.*)" % ("|".join(SUPPORTED_METHODS)))
 
 
 def gencryptsalt():
@@ -48,11 +52,13 @@ class ApiData(object):
         self._model = model
         self.data = {}
         self._upstream_server = ""
+        self.upstream_options = {}
         self.password = ""
         self.http_username = ""
         self.http_password = ""
         self.resources = {}
         self.categories = set()
+        self._index = {}
 
     @property
     def upstream_server(self):
@@ -69,12 +75,14 @@ class ApiData(object):
         self.data = self._model.load()
 
         self.upstream_server = self.data.get("upstream-server", "")
+        self.upstream_options = self.data.get("upstream-options", {})
         self.password = self.data.get("password", "")
         self.resources = self.data.get("resources", self.resources)
         self.http_username = self.data.get("http_username", "")
         self.http_password = self.data.get("http_password", "")
 
         self.load_categories()
+        self.build_index()
 
     def load_categories(self):
         if not self.resources:
@@ -84,6 +92,12 @@ class ApiData(object):
                               for resource in self.resources.values()
                               if "category" in resource)
 
+    def build_index(self):
+        self._index = {}
+
+        for name, data in self.resources.items():
+            self._index_resource(name, data)
+
     def save(self):
         self.data = {}
 
@@ -91,6 +105,8 @@ class ApiData(object):
             self.data["resources"] = self.resources
         if self.upstream_server:
             self.data["upstream-server"] = self.upstream_server
+        if self.upstream_options:
+            self.data["upstream-options"] = self.upstream_options
         if self.password:
             self.data["password"] = self.password
         if self.http_username:
@@ -106,6 +122,10 @@ class ApiData(object):
     def get_upstream_server(self, resource):
         return self._get_resource_attribute(resource, "upstream-server", False)
 
+    def get_validator(self, resource):
+        return self._get_resource_attribute(
+            resource, "validator", DEFAULT_VALIDATOR)
+
     def get_rpc_category(self, method_name):
         return self._get_rpc_attributes(method_name, "category")
 
@@ -150,37 +170,30 @@ class ApiData(object):
     def delete_resource(self, name):
         if name in self.resources:
             del self.resources[name]
+            self._unindex_resource(name)
 
         self.save()
 
     def _get_rpc_attributes(self, method_name, key, default=""):
-
-        method = "RPC-%s" % method_name
-
-        if method in self.resources and \
-                key in self.resources[method]:
-            return self.resources[method][key]
-        else:
-            return default
+        return self.resources.get("RPC-%s" % method_name, {}).get(key, default)
 
     def _get_resource_attribute(self, resource, key, default=""):
-        # get method, status_code and url_path
-        c = re.compile(r"(%s)-(.*)" %
-                       ("|".join(SUPPORTED_METHODS)))
-        m = c.match(resource)
+        # get method and url_path
+        m = RESOURCE_RE.match(resource)
+        if m is None:
+            return default
         method, url_path = m.groups()
 
         # match resource
-        path_regex = "/".join(["(%s|__[^\/]*)" % item
-                               for item in url_path.split("/")])
-        c = re.compile("%s-%s" % (method, path_regex))
+        segments = split_path(url_path)
+        if not segments or method not in self._index:
+            return default
 
-        for resource_name, data in list(self.resources.items()):
-            m = c.match(resource_name)
-            if m and key in data and m.groups()[0] != "":
-                return data[key]
+        data = self._index[method].match(segments, lambda item: key in item)
+        if data is None:
+            return default
 
-        return default
+        return data[key]
 
     def _set_resource_attribute(self, resource, key, value):
         if self.resources:
@@ -197,6 +210,28 @@ class ApiData(object):
                 }
             }
 
+        self._index_resource(resource, self.resources[resource])
+
+    def _index_resource(self, name, data):
+        m = RESOURCE_RE.match(name)
+        if m is None:
+            return
+        method, url_path = m.groups()
+
+        if method not in self._index:
+            self._index[method] = SegmentTrie()
+
+        self._index[method].insert(split_path(url_path), data)
+
+    def _unindex_resource(self, name):
+        m = RESOURCE_RE.match(name)
+        if m is None:
+            return
+        method, url_path = m.groups()
+
+        if method in self._index:
+            self._index[method].remove(split_path(url_path))
+
 
 class BaseMethod(object):
 
@@ -375,5 +410,12 @@ def load_resources_log(log_name):
 
 
 def add_to_resources_log(log_name, data):
+    add_all_to_resources_log(log_name, [data])
+
+
+def add_all_to_resources_log(log_name, items):
+    lines = ["%s\n" % json.dumps(data, cls=ExtendedJSONEncoder)
+             for data in items]
+
     with open(log_name, "a") as f:
-        f.write("%s\n" % json.dumps(data, cls=ExtendedJSONEncoder))
+        f.write("".join(lines))
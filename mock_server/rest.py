@@ -2,15 +2,58 @@
 
 import os
 import re
+import gzip
+import json
+import hashlib
+import datetime
 from . import api
 from . import util
-import tornado.httpclient
+from . import routes
+from . import upstream
 
 from email.parser import Parser
+from io import BytesIO
+from tornado import httputil
+from tornado.escape import utf8
+from tornado.ioloop import IOLoop
+from .data import SUPPORTED_FORMATS, JSON
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from .ordereddict import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+DEFAULT_COMPRESS_MIN_LENGTH = 1024
+HOP_BY_HOP_HEADERS = frozenset([
+    "Connection", "Keep-Alive", "Proxy-Authenticate", "Proxy-Authorization",
+    "Te", "Trailer", "Transfer-Encoding", "Upgrade"])
+COMPRESSIBLE_TYPES = frozenset([
+    "application/json", "application/xml", "application/x-xml",
+    "application/javascript", "application/rss+xml", "application/atom+xml"])
 
 
 class FilesMockProvider(api.FilesMockProvider):
 
+    def __init__(self, api_dir, route_index=None, content_cache=None,
+                 encoder=None):
+        super(FilesMockProvider, self).__init__(api_dir)
+
+        if route_index is None:
+            route_index = routes.RouteIndex(api_dir)
+
+        if encoder is None:
+            encoder = ResponseEncoder()
+
+        self._route_index = route_index
+        self._content_cache = content_cache
+        self._encoder = encoder
+
     def __call__(self, request, status_code=200, format="json"):
 
         self._request = request
@@ -21,25 +64,28 @@ class FilesMockProvider(api.FilesMockProvider):
         response = api.Response()
 
         # get paths
-        paths = self._get_path(self._get_filename())
+        method = request.method
+        paths = self._get_path(self._get_filename(method))
+
+        # HEAD without its own mock is answered by GET mock
+        if not paths and method == "HEAD":
+            method = "GET"
+            paths = self._get_path(self._get_filename(method))
 
         if not paths:
             return self._error(response)
 
         content_path, file_url_path = paths
 
-        headers_path = os.path.join(file_url_path, self._get_header_filename())
+        headers_path = os.path.join(
+            file_url_path, self._get_header_filename(method))
 
-        content = self._get_content(content_path)
+        mock_response = self._get_mock_response(content_path, headers_path)
 
-        if content is None:
+        if mock_response is None:
             return self._error(response)
 
-        response.status_code = status_code
-        response.content = content
-        response.headers = self._get_headers(headers_path)
-
-        return response
+        return mock_response
 
     def _error(self, response, status_code=404):
         self.error = 1
@@ -51,8 +97,44 @@ class FilesMockProvider(api.FilesMockProvider):
 
         return response
 
+    def _get_mock_response(self, content_path, headers_path):
+        load = lambda: self._load_mock_response(content_path, headers_path)
+
+        if self._content_cache is None:
+            return load()[0]
+
+        return self._content_cache.get(
+            content_path, (content_path, headers_path), load)
+
+    def _load_mock_response(self, content_path, headers_path):
+        try:
+            stat = os.stat(content_path)
+        except OSError:
+            return None, 0
+
+        modified = stat.st_mtime
+
+        if self._encoder.is_streamed(stat.st_size):
+            response = self._encoder.prepare_stream(
+                content_path, stat.st_size, self._get_headers(headers_path),
+                self._status_code, self._format, modified)
+
+            return response, response.size
+
+        content = self._get_content(content_path)
+
+        if content is None:
+            return None, 0
+
+        response = self._encoder.prepare(
+            api.Response(content, self._get_headers(headers_path),
+                         self._status_code),
+            self._format, modified)
+
+        return response, response.size
+
     def _get_content(self, content_path):
-        return util.read_file(content_path)
+        return util.read_file(content_path, "rb")
 
     def _get_headers(self, headers_path):
         headers = []
@@ -69,12 +151,12 @@ class FilesMockProvider(api.FilesMockProvider):
         except IOError:
             return headers
 
-    def _get_filename(self):
-        return "%s_%s.%s" % (self._request.method,
+    def _get_filename(self, method=None):
+        return "%s_%s.%s" % (method or self._request.method,
                              self._status_code, self._format)
 
-    def _get_header_filename(self):
-        return "%s_H_%s.%s" % (self._request.method,
+    def _get_header_filename(self, method=None):
+        return "%s_H_%s.%s" % (method or self._request.method,
                                self._status_code, self._format)
 
     def _get_path(self, filename):
@@ -91,17 +173,257 @@ class FilesMockProvider(api.FilesMockProvider):
         if "/" not in url_path:
             return None
 
-        path_regex = []
-        for item in url_path.split("/"):
-            path_regex.append("(%s|__[^\/]*)" % item)
-        c = re.compile("%s%s" % (self._api_dir, "/".join(path_regex)))
+        path = self._route_index.resolve(url_path, filename)
+
+        if path is None:
+            return None
+
+        return os.path.join(path, filename), path
+
+
+class PreparedResponse(api.Response):
+    """Response with encoded body and final headers.
+
+    Prepared responses are shared between requests, don't modify them.
+    Responses of mock files know when the file was modified and can be
+    validated by ETag and Last-Modified. They can have compressed
+    variants, see :meth:`get_variant`.
+    """
+
+    def __init__(self, content, headers, status_code=200, modified=None,
+                 etag=None):
+        super(PreparedResponse, self).__init__(
+            utf8(content), tuple(headers), status_code)
+
+        self._etag = etag
+        self.variants = ()
+
+        if modified is None:
+            self.last_modified = None
+            self.last_modified_header = None
+        else:
+            self.last_modified = datetime.datetime.utcfromtimestamp(
+                int(modified))
+            self.last_modified_header = httputil.format_timestamp(
+                self.last_modified)
+
+    @property
+    def etag(self):
+        if self._etag is None:
+            self._etag = '"%s"' % hashlib.sha1(self.content).hexdigest()
+
+        return self._etag
+
+    @property
+    def content_length(self):
+        return len(self.content)
+
+    @property
+    def size(self):
+        return (len(self.content) +
+                sum(len(name) + len(value) for name, value in self.headers) +
+                sum(variant.size for coding, variant in self.variants))
+
+    def get_variant(self, accept_encoding):
+        """Returns variant of response for Accept-Encoding header."""
+        if not self.variants or not accept_encoding:
+            return self
+
+        coding = negotiate_encoding(
+            accept_encoding, [coding for coding, variant in self.variants])
+
+        for variant_coding, variant in self.variants:
+            if variant_coding == coding:
+                return variant
+
+        return self
+
+
+class StreamedResponse(PreparedResponse):
+    """Response of a large mock file which is not kept in memory, its
+    body is streamed from ``path``.
+    """
+
+    def __init__(self, path, content_length, headers, status_code=200,
+                 modified=None):
+        super(StreamedResponse, self).__init__(
+            b"", headers, status_code, modified,
+            '"%x-%x"' % (int(modified or 0), content_length))
+
+        self.path = path
+        self._content_length = content_length
+
+    @property
+    def content_length(self):
+        return self._content_length
+
+
+class ResponseEncoder(object):
+    """Prepares responses of mock files.
+
+    JSON bodies can be minified and bodies of compressible content types
+    longer than ``compress_min_length`` get gzip (and brotli when it is
+    installed) variants, ``compress_min_length=None`` disables it. Files
+    of ``stream_threshold`` bytes and more are not read into memory.
+    """
+
+    def __init__(self, compress_min_length=None, compress_level=6,
+                 minify_json=False, stream_threshold=None):
+        self.compress_min_length = compress_min_length
+        self.compress_level = compress_level
+        self.minify_json = minify_json
+        self.stream_threshold = stream_threshold
+
+    def is_streamed(self, size):
+        return self.stream_threshold is not None and \
+            size >= max(self.stream_threshold, 1)
+
+    def prepare_stream(self, path, size, headers, status_code, format,
+                       modified):
+        prepared = prepare_response(
+            api.Response(b"", list(headers) + [("Accept-Ranges", "bytes")],
+                         status_code), format)
+
+        return StreamedResponse(
+            path, size,
+            _replace_header(prepared.headers, "Content-Length", str(size)),
+            status_code, modified)
+
+    def prepare(self, response, format, modified=None):
+        if self.minify_json and format == JSON:
+            response.content = minify_json(response.content)
 
-        for path in os.walk(self._api_dir):
-            m = c.match(path[0])
-            if m:
-                return os.path.join(path[0], filename), path[0]
+        response.headers = list(response.headers) + [
+            ("Accept-Ranges", "bytes")]
+        prepared = prepare_response(response, format, modified)
 
-        return None
+        if self.compress_min_length is None or \
+                len(prepared.content) < self.compress_min_length or \
+                not is_compressible(prepared.headers):
+            return prepared
+
+        variants = []
+        for coding, compress in self._codings():
+            content = compress(prepared.content)
+            if len(content) < len(prepared.content):
+                variants.append((coding, content))
+
+        if not variants:
+            return prepared
+
+        headers = _add_vary(prepared.headers, "Accept-Encoding")
+        identity = PreparedResponse(
+            prepared.content, headers, prepared.status_code, modified)
+
+        identity.variants = tuple(
+            (coding, PreparedResponse(
+                content,
+                _replace_header(
+                    headers, "Content-Length", str(len(content))) +
+                [("Content-Encoding", coding)],
+                prepared.status_code, modified,
+                '%s-%s"' % (identity.etag[:-1], coding)))
+            for coding, content in variants)
+
+        return identity
+
+    def _codings(self):
+        if brotli is not None:
+            yield "br", brotli.compress
+
+        yield "gzip", self._gzip
+
+    def _gzip(self, data):
+        out = BytesIO()
+        with gzip.GzipFile(mode="wb", fileobj=out, mtime=0,
+                           compresslevel=self.compress_level) as f:
+            f.write(data)
+        return out.getvalue()
+
+
+def minify_json(content):
+    try:
+        data = json.loads(
+            utf8(content).decode("utf-8"), object_pairs_hook=OrderedDict)
+    except ValueError:
+        return content
+
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def is_compressible(headers):
+    for name, value in headers:
+        if name.lower() == "content-type":
+            content_type = value.split(";")[0].strip().lower()
+            return (content_type.startswith("text/") or
+                    content_type in COMPRESSIBLE_TYPES or
+                    content_type.endswith(("+xml", "+json")))
+
+    return False
+
+
+def negotiate_encoding(accept_encoding, codings):
+    """Returns the most preferred of ``codings`` accepted by
+    Accept-Encoding header or None.
+    """
+    qualities = {}
+
+    for item in accept_encoding.split(","):
+        params = item.split(";")
+        quality = 1.0
+
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities[params[0].strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+
+    for coding in codings:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+
+    return best
+
+
+def _add_vary(headers, value):
+    for name, current in headers:
+        if name.lower() == "vary":
+            return _replace_header(headers, name, "%s, %s" % (current, value))
+
+    return list(headers) + [("Vary", value)]
+
+
+def _replace_header(headers, header_name, header_value):
+    return [(name, header_value if name == header_name else value)
+            for name, value in headers]
+
+
+def prepare_response(response, format, modified=None):
+    if isinstance(response, PreparedResponse):
+        return response
+
+    content = utf8(response.content)
+    headers = [(name, value) for name, value in response.headers
+               if name.lower() != "content-length"]
+
+    # set content type
+    if not [name for name, value in headers
+            if name.lower() == "content-type"]:
+        headers.append(
+            ("Content-Type",
+             "%s; charset=utf-8" % SUPPORTED_FORMATS[format][0]))
+
+    headers.append(("Access-Control-Allow-Origin", "*"))
+    headers.append(("Content-Length", str(len(content))))
+
+    return PreparedResponse(content, headers, response.status_code, modified)
 
 
 def get_desired_response(provider, request, status_code=200, format="json"):
@@ -124,20 +446,32 @@ def default_response(method, url_path, status_code, format):
     return content, [("Content-Type", "text/html")]
 
 
+def proxy_headers(headers):
+    """Returns copy of ``headers`` without hop-by-hop headers."""
+    result = httputil.HTTPHeaders()
+
+    for name, value in headers.get_all():
+        if name not in HOP_BY_HOP_HEADERS:
+            result.add(name, value)
+
+    return result
+
+
 class UpstreamServerProvider(api.UpstreamServerProvider):
 
-    def __init__(self, upstream_server):
+    def __init__(self, upstream_server, client=None, options=None):
         super(UpstreamServerProvider, self).__init__(upstream_server)
 
-        self._http_client = None
+        self._client = client
+        self._options = options
         self._request_handler_callback = None
 
     @property
-    def http_client(self):
-        if self._http_client is None:
-            self._http_client = tornado.httpclient.AsyncHTTPClient()
+    def client(self):
+        if self._client is None:
+            self._client = upstream.UpstreamClient()
 
-        return self._http_client
+        return self._client
 
     def __call__(self, data, request_handler_callback):
         self._request_handler_callback = request_handler_callback
@@ -151,10 +485,12 @@ class UpstreamServerProvider(api.UpstreamServerProvider):
         if "If-None-Match" in data["headers"]:
             del data["headers"]["If-None-Match"]
 
-        self.http_client.fetch(
-            "%s%s" % (self.upstream_server, data["uri"]),
-            callback=self._on_response, method=data["method"],
-            body=body, headers=data["headers"], follow_redirects=True)
+        IOLoop.current().add_future(
+            self.client.fetch(
+                "%s%s" % (self.upstream_server, data["uri"]),
+                self._options, method=data["method"], body=body,
+                headers=data["headers"], follow_redirects=True),
+            lambda future: self._on_response(future.result()))
 
     def _on_response(self, response):
         if response.error:
@@ -172,6 +508,84 @@ class UpstreamServerProvider(api.UpstreamServerProvider):
             api.Response(data, headers, status_code))
 
 
+class StreamingUpstreamServerProvider(UpstreamServerProvider):
+    """Relays upstream response while it is being received.
+
+    ``header_callback`` is called with status code, reason and headers as
+    soon as they arrive, ``streaming_callback`` with every chunk of the
+    body, it may return Future to pause reading from upstream.
+    ``request_handler_callback`` is called at the end, with the default
+    response when upstream didn't respond. Request body can be passed as
+    ``body_producer`` in data.
+    """
+
+    def __init__(self, upstream_server, header_callback, streaming_callback,
+                 client=None, options=None):
+        super(StreamingUpstreamServerProvider, self).__init__(
+            upstream_server, client, options)
+
+        self._header_callback = header_callback
+        self._streaming_callback = streaming_callback
+        self._header_lines = []
+        self.headers_received = False
+
+    def __call__(self, data, request_handler_callback):
+        self._request_handler_callback = request_handler_callback
+        self._data = data
+
+        kwargs = {}
+
+        if data["method"] in ("POST", "PATCH", "PUT"):
+            if data.get("body_producer") is not None:
+                kwargs["body_producer"] = data["body_producer"]
+            else:
+                kwargs["body"] = data["body"]
+
+        # 100-continue was already handled with the client
+        headers = proxy_headers(data["headers"])
+        for name in ("If-None-Match", "Expect"):
+            if name in headers:
+                del headers[name]
+
+        # redirects and compressed bodies are passed to the client as they
+        # are, Content-Length of upstream response stays valid
+        IOLoop.current().add_future(
+            self.client.fetch(
+                "%s%s" % (self.upstream_server, data["uri"]),
+                self._options, method=data["method"], headers=headers,
+                follow_redirects=False, decompress_response=False,
+                header_callback=self._on_header_line,
+                streaming_callback=self._streaming_callback, **kwargs),
+            lambda future: self._on_response(future.result()))
+
+    def _on_header_line(self, line):
+        if line.startswith("HTTP/"):
+            self._header_lines = [line]
+        elif line.strip():
+            self._header_lines.append(line)
+        elif self._header_lines:
+            start_line = httputil.parse_response_start_line(
+                self._header_lines[0])
+            if start_line.code < 200:
+                # informational response, the final one follows
+                self._header_lines = []
+                return
+            headers = proxy_headers(
+                httputil.HTTPHeaders.parse("".join(self._header_lines[1:])))
+
+            self.headers_received = True
+            self._header_callback(
+                start_line.code, start_line.reason, list(headers.get_all()))
+
+    def _on_response(self, response):
+        if not self.headers_received:
+            return super(StreamingUpstreamServerProvider, self)._on_response(
+                response)
+
+        self._request_handler_callback(
+            api.Response(b"", [], response.code))
+
+
 if __name__ == "__main__":
 
     provider = FilesMockProvider("/Users/tomashanacek/Downloads/api")
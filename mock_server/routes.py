@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+
+
+VARIABLE_PREFIX = "__"
+
+
+def is_variable(segment):
+    return segment.startswith(VARIABLE_PREFIX)
+
+
+def split_path(path):
+    return [segment for segment in path.strip("/").split("/") if segment]
+
+
+class _Node(object):
+
+    __slots__ = ("children", "variables", "value")
+
+    def __init__(self):
+        self.children = {}
+        self.variables = []
+        self.value = None
+
+
+class SegmentTrie(object):
+    """Maps url path segments to values.
+
+    Segments starting with ``__`` are variables and match any single
+    segment of the looked up path. Literal segments always take
+    precedence over variables, variables are tried in name order.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def insert(self, segments, value):
+        node = self._root
+
+        for segment in segments:
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+                if is_variable(segment):
+                    node.variables.append(segment)
+                    node.variables.sort()
+            node = child
+
+        node.value = value
+
+    def get(self, segments):
+        node = self._root
+
+        for segment in segments:
+            node = node.children.get(segment)
+            if node is None:
+                return None
+
+        return node.value
+
+    def remove(self, segments):
+        path = [self._root]
+
+        for segment in segments:
+            node = path[-1].children.get(segment)
+            if node is None:
+                return
+            path.append(node)
+
+        path[-1].value = None
+
+        # prune empty nodes
+        for parent, segment in reversed(list(zip(path[:-1], segments))):
+            node = parent.children[segment]
+            if node.value is not None or node.children:
+                break
+            del parent.children[segment]
+            if is_variable(segment):
+                parent.variables.remove(segment)
+
+    def match(self, segments, predicate=None):
+        """Returns the first value whose path matches ``segments`` and
+        for which ``predicate`` is true.
+        """
+        return self._match(self._root, segments, 0, predicate)
+
+    def _match(self, node, segments, index, predicate):
+        if index == len(segments):
+            if node.value is not None and \
+                    (predicate is None or predicate(node.value)):
+                return node.value
+            return None
+
+        segment = segments[index]
+
+        # literal first
+        child = node.children.get(segment)
+        if child is not None:
+            value = self._match(child, segments, index + 1, predicate)
+            if value is not None:
+                return value
+
+        for variable in node.variables:
+            if variable == segment:
+                continue
+
+            value = self._match(
+                node.children[variable], segments, index + 1, predicate)
+            if value is not None:
+                return value
+
+        return None
+
+
+class RouteDir(object):
+
+    __slots__ = ("path", "files")
+
+    def __init__(self, path, files):
+        self.path = path
+        self.files = files
+
+
+class RouteIndex(object):
+    """In-memory index of the api dir.
+
+    The index is built on first use and kept until it is invalidated,
+    lookups cost O(path depth) instead of walking the whole tree.
+    """
+
+    def __init__(self, api_dir):
+        self.api_dir = api_dir
+        self._trie = None
+
+    @property
+    def trie(self):
+        if self._trie is None:
+            self.build()
+
+        return self._trie
+
+    def build(self):
+        trie = SegmentTrie()
+
+        for dirpath, dirnames, filenames in os.walk(self.api_dir):
+            relpath = os.path.relpath(dirpath, self.api_dir)
+            segments = [] if relpath == os.curdir else relpath.split(os.sep)
+
+            trie.insert(segments, RouteDir(dirpath, frozenset(filenames)))
+
+        self._trie = trie
+
+    def invalidate(self):
+        self._trie = None
+
+    def resolve(self, url_path, filename):
+        """Returns dir which matches ``url_path`` and contains
+        ``filename`` or None.
+        """
+        route_dir = self.trie.match(
+            split_path(url_path), lambda item: filename in item.files)
+
+        if route_dir is None:
+            return None
+
+        return route_dir.path
@@ -4,7 +4,8 @@ import os
 import json
 from . import util
 from . import api
-import tornado.httpclient
+from . import upstream
+from tornado.ioloop import IOLoop
 
 from abc import abstractmethod
 
@@ -86,26 +87,29 @@ class FilesMockProvider(api.FilesMockProvider):
 
 class UpstreamServerProvider(api.UpstreamServerProvider):
 
-    def __init__(self, upstream_server):
+    def __init__(self, upstream_server, client=None, options=None):
         super(UpstreamServerProvider, self).__init__(upstream_server)
 
-        self._http_client = None
+        self._client = client
+        self._options = options
         self._request_handler_callback = None
 
     @property
-    def http_client(self):
-        if self._http_client is None:
-            self._http_client = tornado.httpclient.AsyncHTTPClient()
+    def client(self):
+        if self._client is None:
+            self._client = upstream.UpstreamClient()
 
-        return self._http_client
+        return self._client
 
     def __call__(self, data, request_handler_callback):
         self._request_handler_callback = request_handler_callback
 
-        self.http_client.fetch(
-            "%s%s" % (self.upstream_server, data["uri"]),
-            callback=self._on_response, method=data["method"],
-            body=data["body"], headers=data["headers"], follow_redirects=True)
+        IOLoop.current().add_future(
+            self.client.fetch(
+                "%s%s" % (self.upstream_server, data["uri"]),
+                self._options, method=data["method"], body=data["body"],
+                headers=data["headers"], follow_redirects=True),
+            lambda future: self._on_response(future.result()))
 
     def _on_response(self, response):
         self._request_handler_callback(
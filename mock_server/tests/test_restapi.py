@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import os
+import gzip
+import json
+import datetime
 import subprocess
 import time
 
 import tornado.testing
 from mock_server.application import Application
+from mock_server.api_settings import ApiSettings
+from mock_server.model import load_resources_log
 
 
 class TestRestApi(tornado.testing.AsyncHTTPTestCase):
@@ -37,6 +42,99 @@ class TestRestApi(tornado.testing.AsyncHTTPTestCase):
         self.assertEqual(response.code, 200)
         self.assertEqual(response.body, '["john", "tom"]\n')
 
+    def test_head_list_users(self):
+        response = self.fetch("/user", method="HEAD")
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "")
+        self.assertEqual(response.headers["Content-Length"], "16")
+        self.assertEqual(
+            response.headers["Content-Type"],
+            "application/json; charset=utf-8")
+
+    def test_etag_not_modified(self):
+        response = self.fetch("/user")
+        self.assertTrue(response.headers["Etag"])
+
+        response = self.fetch(
+            "/user", headers={"If-None-Match": response.headers["Etag"]})
+
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, "")
+
+    def test_last_modified_not_modified(self):
+        response = self.fetch("/user")
+        self.assertTrue(response.headers["Last-Modified"])
+
+        response = self.fetch(
+            "/user",
+            headers={"If-Modified-Since": response.headers["Last-Modified"]})
+
+        self.assertEqual(response.code, 304)
+
+    def test_resource_without_validators(self):
+        response = self.fetch("/user/lisa/family/homer")
+
+        self.assertEqual(response.code, 200)
+        self.assertFalse("Etag" in response.headers)
+        self.assertFalse("Last-Modified" in response.headers)
+
+    def test_gzip_variant(self):
+        response = self.fetch(
+            "/products", headers={"Accept-Encoding": "gzip"},
+            decompress_response=False)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(
+            int(response.headers["Content-Length"]), len(response.body))
+
+        with open(os.path.join(
+                os.path.dirname(__file__), "api/products/GET_200.json")) as f:
+            self.assertEqual(
+                gzip.GzipFile(fileobj=response.buffer).read(), f.read())
+
+        response = self.fetch(
+            "/products", headers={"Accept-Encoding": "identity"},
+            decompress_response=False)
+
+        self.assertFalse("Content-Encoding" in response.headers)
+
+    def test_range(self):
+        response = self.fetch("/user", headers={"Range": "bytes=2-5"})
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, 'john')
+        self.assertEqual(response.headers["Content-Range"], "bytes 2-5/16")
+
+        response = self.fetch("/user", headers={"Range": "bytes=20-"})
+
+        self.assertEqual(response.code, 416)
+
+    def test_streamed_large_file(self):
+        self._app.encoder.stream_threshold = 10
+
+        response = self.fetch("/products")
+
+        self.assertEqual(response.code, 200)
+        with open(os.path.join(
+                os.path.dirname(__file__), "api/products/GET_200.json")) as f:
+            self.assertEqual(response.body, f.read())
+
+        response = self.fetch(
+            "/user/lisa/family/bart",
+            headers={"Range": "bytes=-7",
+                     "If-Range": response.headers["Etag"]})
+
+        self.assertEqual(response.code, 200)
+
+        response = self.fetch(
+            "/user/lisa/family/bart", headers={"Range": "bytes=-7"})
+
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, 'bart"}\n')
+
     def test_user_doesnt_exists_with_custom_header(self):
         response = self.fetch("/user/tom?__statusCode=404")
 
@@ -62,12 +160,80 @@ class TestRestApi(tornado.testing.AsyncHTTPTestCase):
         self.assertEqual(response.code, 200)
         self.assertTrue("bart" in response.body)
 
+    def test_url_literal_before_variable(self):
+        response = self.fetch("/user/lisa/family/homer")
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, '{"name": "homer"}\n')
+
+    def test_url_with_variables_after_literal_miss(self):
+        response = self.fetch("/user/tom/family/bart")
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, '{"name": "bart"}\n')
+
+    def test_content_cache(self):
+        self.fetch("/user")
+        response = self.fetch("/user")
+
+        self.assertEqual(response.body, '["john", "tom"]\n')
+
+        stats = json.loads(self.fetch("/__manage/stats").body)
+        self.assertEqual(stats["content_cache"]["hits"], 1)
+
+        response = self.fetch(
+            "/__manage/cache", method="POST", body="",
+            headers={"X-XSRFToken": "xsrf", "Cookie": "_xsrf=xsrf"})
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["entries"], 0)
+
+    def test_api_data_is_shared(self):
+        api_data = ApiSettings(self._app.settings, None).api_data
+
+        self.assertTrue(
+            ApiSettings(self._app.settings, None).api_data is api_data)
+
+    def test_access_log(self):
+        self.fetch("/user/lisa/family/bart")
+        self._app.access_log.flush()
+
+        log = load_resources_log(os.path.join(
+            self._app.settings["dir"], "access-%s.log" %
+            datetime.datetime.now().strftime("%Y-%m-%d")))
+
+        self.assertEqual(log[-1]["url_path"], "/user/lisa/family/bart")
+        self.assertEqual(log[-1]["response"]["status_code"], 200)
+
     def test_hello_on_upstream_server(self):
         response = self.fetch("/hello")
 
         self.assertEqual(response.code, 200)
         self.assertEqual(response.body, "Hello from upstream server")
 
+    def test_streaming_upstream(self):
+        self._app.settings["upstream_streaming"] = True
+
+        response = self.fetch("/hello")
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "Hello from upstream server")
+        self.assertEqual(response.headers["Content-Type"], "application/json")
+
+        response = self.fetch("/hello", method="POST", body="x" * 100000)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "Hello from upstream server")
+
+    def test_upstream_stats(self):
+        self.fetch("/hello")
+
+        stats = json.loads(self.fetch("/__manage/stats").body)["upstream"]
+
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["active"], 0)
+        self.assertEqual(stats["waiting"], 0)
+
     def test_custom_provider(self):
         response = self.fetch("/abc")
 
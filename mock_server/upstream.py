@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import os
+import logging
+
+from six.moves.urllib.parse import urlsplit
+from tornado import gen
+from tornado import locks
+from tornado.ioloop import IOLoop
+from tornado.httpclient import HTTPRequest
+from tornado.simple_httpclient import SimpleAsyncHTTPClient, _HTTPConnection
+
+
+DEFAULT_MAX_CLIENTS = 100
+DEFAULT_MAX_PER_HOST = 20
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_REQUEST_TIMEOUT = 30.0
+
+# keys of "upstream-options" in application data which override
+# arguments of every upstream request
+REQUEST_OPTIONS = ("connect_timeout", "request_timeout")
+
+
+class _HTTPConnectionWithBackpressure(_HTTPConnection):
+
+    def data_received(self, chunk):
+        if self._should_follow_redirect():
+            return
+        if self.request.streaming_callback is not None:
+            # reading from upstream waits for the returned Future
+            return self.request.streaming_callback(chunk)
+        else:
+            self.chunks.append(chunk)
+
+
+class HTTPClient(SimpleAsyncHTTPClient):
+    """Simple http client whose ``streaming_callback`` may return Future,
+    the response is not read until the Future is resolved.
+    """
+
+    def _connection_class(self):
+        return _HTTPConnectionWithBackpressure
+
+
+class UpstreamClient(object):
+    """Shared pool of connections to upstream servers.
+
+    Upstream requests are limited to ``max_clients`` in total and
+    ``max_per_host`` per upstream host, requests over the limits wait in
+    a queue. With ``use_curl`` requests go through ``curl_httpclient``
+    which keeps connections alive, the simple client is used when pycurl
+    is not installed. Only the simple client pauses reading of streamed
+    responses (see :class:`HTTPClient`).
+
+    The http client is bound to the IOLoop, so it is created on first
+    fetch in every process.
+    """
+
+    def __init__(self, max_clients=DEFAULT_MAX_CLIENTS,
+                 max_per_host=DEFAULT_MAX_PER_HOST,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT, use_curl=False):
+        self.max_clients = max_clients
+        self.max_per_host = max_per_host
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.use_curl = use_curl
+
+        self._http_client = None
+        self._io_loop = None
+        self._pid = None
+        self._hosts = {}
+
+        self.requests = 0
+        self.errors = 0
+        self.waiting = 0
+        self.active = 0
+        self.max_waiting = 0
+
+    @property
+    def http_client(self):
+        io_loop = IOLoop.current()
+
+        if self._http_client is None or self._io_loop is not io_loop or \
+                self._pid != os.getpid():
+            self._http_client = self._create_http_client()
+            self._io_loop = io_loop
+            self._pid = os.getpid()
+            self._hosts = {}
+
+        return self._http_client
+
+    @property
+    def backend(self):
+        if self._http_client is None:
+            return None
+
+        return type(self._http_client).__name__
+
+    def fetch(self, url, options=None, **kwargs):
+        """Fetches ``url`` and returns Future with HTTPResponse.
+
+        Errors are not raised, they are available in ``response.error``.
+        ``options`` are the ``upstream-options`` of application data.
+        """
+        kwargs.setdefault("connect_timeout", self.connect_timeout)
+        kwargs.setdefault("request_timeout", self.request_timeout)
+
+        if options:
+            for key in REQUEST_OPTIONS:
+                if key in options:
+                    kwargs[key] = options[key]
+
+        return self._fetch(HTTPRequest(url, **kwargs))
+
+    @gen.coroutine
+    def _fetch(self, request):
+        http_client = self.http_client
+        semaphore = self._get_semaphore(urlsplit(request.url).netloc)
+
+        self.requests += 1
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+
+        try:
+            yield semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+
+        try:
+            response = yield http_client.fetch(request, raise_error=False)
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+        if response.error:
+            self.errors += 1
+
+        raise gen.Return(response)
+
+    def _get_semaphore(self, host):
+        semaphore = self._hosts.get(host)
+
+        if semaphore is None:
+            semaphore = self._hosts[host] = locks.Semaphore(self.max_per_host)
+
+        return semaphore
+
+    def _create_http_client(self):
+        if self.use_curl:
+            try:
+                from tornado.curl_httpclient import CurlAsyncHTTPClient
+            except ImportError:
+                logging.warning(
+                    "pycurl is not installed, using simple http client")
+            else:
+                return CurlAsyncHTTPClient(
+                    force_instance=True, max_clients=self.max_clients)
+
+        return HTTPClient(force_instance=True, max_clients=self.max_clients)
+
+    def stats(self):
+        queued = 0
+
+        if self._http_client is not None:
+            # requests waiting for a free connection in the http client
+            queued = len(getattr(self._http_client, "queue", None) or
+                         getattr(self._http_client, "_requests", None) or ())
+
+        return {
+            "backend": self.backend,
+            "max_clients": self.max_clients,
+            "max_per_host": self.max_per_host,
+            "requests": self.requests,
+            "active": self.active,
+            "waiting": self.waiting,
+            "queued": queued,
+            "max_waiting": self.max_waiting,
+            "errors": self.errors
+        }
+
+    def close(self):
+        if self._http_client is not None and self._pid == os.getpid():
+            self._http_client.close()
+        self._http_client = None
@@ -10,10 +10,10 @@ from random import choice
 from tornado.httputil import HTTPHeaders
 
 
-def read_file(filename):
+def read_file(filename, mode="r"):
     if os.path.isfile(filename):
         try:
-            with open(filename) as f:
+            with open(filename, mode) as f:
                 content = f.read()
                 return content
         except IOError:
@@ -30,8 +30,12 @@ def generate_password(length=8):
 class ExtendedJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, api.Response):
+            content = obj.content
+            if isinstance(content, bytes):
+                content = content.decode("utf-8", "replace")
+
             return {
-                "body": obj.content,
+                "body": content,
                 "headers": obj.headers,
                 "status_code": obj.status_code
             }
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import atexit
+import logging
+import threading
+
+from six.moves import queue
+
+from . import model
+
+
+DROP = "drop"
+SAMPLE = "sample"
+BLOCK = "block"
+OVERFLOW_POLICIES = (DROP, SAMPLE, BLOCK)
+
+
+class _Flush(object):
+
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.event = threading.Event()
+
+
+class BatchWriter(object):
+    """Writes records in batches on a background thread.
+
+    Records are kept in a bounded queue and written when ``flush_size``
+    of them are collected or ``flush_interval`` seconds elapsed. When the
+    queue is full new records are dropped (``drop``), only every
+    ``sample_rate``-th record is kept once the queue is half full
+    (``sample``) or the caller waits (``block``).
+
+    The thread is started on first write in every process, so writers
+    may be created before the server forks.
+    """
+
+    def __init__(self, max_queue_size=10000, flush_interval=1.0,
+                 flush_size=100, overflow=DROP, sample_rate=10):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: %s" % overflow)
+
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._sample_counter = 0
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+    def write(self, record):
+        """Queues ``record``, returns False when it was dropped."""
+        self._start()
+
+        if self.overflow == BLOCK:
+            self._queue.put(record)
+            return True
+
+        if self.overflow == SAMPLE and \
+                self._queue.qsize() >= self.max_queue_size // 2:
+            self._sample_counter += 1
+            if self._sample_counter % self.sample_rate:
+                self.dropped += 1
+                return False
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        return True
+
+    def flush(self, timeout=None):
+        """Blocks until all queued records are written."""
+        if not self._running():
+            return
+
+        marker = _Flush()
+        self._queue.put(marker)
+        marker.event.wait(timeout)
+
+    def close(self, timeout=None):
+        if not self._running():
+            return
+
+        marker = _Flush(stop=True)
+        self._queue.put(marker)
+        marker.event.wait(timeout)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._running() else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors
+        }
+
+    def _write_batch(self, records):
+        raise NotImplementedError()
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid()
+
+    def _start(self):
+        if self._running():
+            return
+
+        with self._lock:
+            if self._running():
+                return
+
+            self._pid = os.getpid()
+            self._queue = queue.Queue(self.max_queue_size)
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+            atexit.register(self.close)
+
+    def _run(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Flush):
+                self._flush(batch)
+                batch = []
+                item.event.set()
+                if item.stop:
+                    return
+                continue
+
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.flush_size or time.time() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.time() + self.flush_interval
+
+    def _flush(self, batch):
+        if not batch:
+            return
+
+        try:
+            self._write_batch(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception:
+            self.errors += 1
+            logging.exception("Error in writing %d records" % len(batch))
+
+
+class AccessLogWriter(BatchWriter):
+    """Appends ``(log_name, data)`` records to access logs."""
+
+    def _write_batch(self, records):
+        logs = {}
+
+        for log_name, data in records:
+            logs.setdefault(log_name, []).append(data)
+
+        for log_name, items in logs.items():
+            model.add_all_to_resources_log(log_name, items)